@@ -4,23 +4,82 @@ Fishbone Diagram Root Cause Analysis with LangGraph.
 
 from __future__ import annotations
 
-import json
+import asyncio
+import email.utils
+import functools
 import os
 import sys
+import threading
 from datetime import datetime
-from typing import Dict, List, Optional, TypedDict
+from typing import Dict, List, Optional, Tuple, TypedDict
 
+import aiofiles
+import httpx
+import orjson
 from dotenv import load_dotenv
+from langchain_core.caches import InMemoryCache
+from langchain_core.globals import set_llm_cache
 from langchain_openai import ChatOpenAI
+from langgraph.cache.memory import InMemoryCache as GraphCache
 from langgraph.graph import END, StateGraph
+from langgraph.graph.state import CompiledStateGraph
+from langgraph.types import CachePolicy
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    InternalServerError,
+    OpenAIError,
+    RateLimitError,
+)
+from tenacity import (
+    RetryCallState,
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
 
 # Load environment variables
 load_dotenv()
 
+class JSONResponseCache(InMemoryCache):
+    """In-memory LLM cache that only keeps replies that decode as JSON.
+    
+    Every prompt here runs in JSON mode, so a reply that fails to decode
+    was truncated or malformed and must not be replayed on later runs.
+    """
+    
+    def update(self, prompt: str, llm_string: str, return_val: list) -> None:
+        try:
+            for generation in return_val:
+                # generation.text is a str subclass, which orjson rejects
+                orjson.loads(str(generation.text))
+        except orjson.JSONDecodeError:
+            return
+        super().update(prompt, llm_string, return_val)
+
+
+# Cache LLM responses so repeated analyses skip the API call.
+# Registered before the shared ChatOpenAI client is built.
+set_llm_cache(JSONResponseCache())
+
 # Configuration constants
 MODEL = "gpt-4o-mini"
 MAX_CAUSES_PER_CATEGORY = 3
 MAX_ROOT_CAUSES_PER_CAUSE = 3
+MAX_KEEPALIVE_CONNECTIONS = 20
+MAX_TOKENS_PER_EFFECT = 1800
+REQUEST_TIMEOUT = 30  # Seconds per effect's worth of output tokens
+MAX_BATCH_SIZE = 8
+MAX_CONCURRENT_LLM_CALLS = 8
+MAX_LLM_ATTEMPTS = 3
+SAVE_REPORT_GRACE = 1.0  # Seconds to wait for a save before the next prompt
+TOKENS_PER_PROGRESS_DOT = 20
+# Errors worth retrying, as in the OpenAI SDK's own retry rules;
+# APITimeoutError subclasses APIConnectionError
+TRANSIENT_API_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+RETRYABLE_STATUS_CODES = (408, 409)
+MAX_RETRY_AFTER = 60  # Longer server-requested waits fall back to backoff
 CATEGORIES_6M = [
     "Man (People)",
     "Machine",
@@ -30,6 +89,45 @@ CATEGORIES_6M = [
     "Environment"
 ]
 
+# Invariant instructions and schema live in the system message, so every
+# request starts with the same prefix for OpenAI prompt caching to reuse
+_ANALYSIS_RULES = (
+    f"You are a Root Cause Analysis expert. Return only JSON. "
+    f"Maximum {MAX_CAUSES_PER_CATEGORY} causes per given category, "
+    f"each 5 words or less. "
+    f"For each cause, apply 5 Whys: {MAX_ROOT_CAUSES_PER_CAUSE} reasons, "
+    f"each 8 words or less."
+)
+_RESULT_SCHEMA = (
+    '"causes": {"Category": ["cause1", "cause2", "cause3"]}, '
+    '"root_causes": {"Category:cause": ["why1", "why2", "why3"]}'
+)
+_SYSTEM_PROMPT = f"{_ANALYSIS_RULES}\nJSON format: {{{_RESULT_SCHEMA}}}"
+_BATCH_SYSTEM_PROMPT = (
+    f"{_ANALYSIS_RULES}\n"
+    f"Analyze each effect independently, one result per effect in order, "
+    f"echoing the effect text verbatim.\n"
+    f'JSON format: {{"results": [{{"effect": "effect1", {_RESULT_SCHEMA}}}]}}'
+)
+
+@functools.lru_cache(maxsize=None)
+def get_shared_llm() -> ChatOpenAI:
+    """Return the process-wide LLM client shared by all agents.
+    
+    Built lazily so importing this module does not require an API key,
+    and shared so every agent reuses one pooled HTTP connection.
+    """
+    limits = httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS)
+    return ChatOpenAI(
+        model=MODEL,
+        temperature=0,
+        timeout=REQUEST_TIMEOUT,
+        max_retries=0,  # Retries are handled by CombinedAnalyzerAgent
+        http_client=httpx.Client(limits=limits),
+        http_async_client=httpx.AsyncClient(limits=limits)
+    )
+
+
 class FishboneState(TypedDict):
     """State for Fishbone analysis workflow."""
     effect: str
@@ -39,167 +137,208 @@ class FishboneState(TypedDict):
     metadata: Dict[str, str]
 
 
-class CauseIdentifierAgent:
-    """Agent for identifying initial causes in Fishbone categories."""
+def analysis_cache_key(state: FishboneState) -> bytes:
+    """Cache key for the analysis node, which depends only on its inputs."""
+    # Serialized as JSON so no two distinct inputs can collide
+    return orjson.dumps([state["effect"], state["categories"]])
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Whether an API error is worth retrying."""
+    if isinstance(error, TRANSIENT_API_ERRORS):
+        return True
+    return (
+        isinstance(error, APIStatusError)
+        and error.status_code in RETRYABLE_STATUS_CODES
+    )
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Read the wait the API asked for from Retry-After headers, if any."""
+    if not isinstance(error, APIStatusError):
+        return None
+    
+    headers = error.response.headers
+    try:
+        return float(headers["retry-after-ms"]) / 1000
+    except (KeyError, ValueError):
+        pass
+    
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    
+    # Retry-After may also be an HTTP date
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return retry_at.timestamp() - datetime.now().timestamp()
+
+
+_exponential_backoff = wait_exponential_jitter(initial=1, max=10)
+
+
+def wait_for_retry(retry_state: RetryCallState) -> float:
+    """Honor the API's Retry-After on 429s, else back off exponentially."""
+    retry_after = retry_after_seconds(retry_state.outcome.exception())
+    if retry_after is not None and 0 < retry_after <= MAX_RETRY_AFTER:
+        return retry_after
+    return _exponential_backoff(retry_state)
+
+
+def clean_items(items: object, limit: int) -> List[str]:
+    """Strip string items in one pass, dropping blanks, up to limit."""
+    # Exact type checks: decoded JSON never contains list or str subclasses
+    if type(items) is not list:
+        return []
+    stripped = (item.strip() for item in items if type(item) is str)
+    return [item for item in stripped if item][:limit]
+
+
+class CombinedAnalyzerAgent:
+    """Agent for identifying causes and their root causes in a single call."""
     
-    def __init__(self, model: str = MODEL, temperature: float = 0):
-        self.agent_name = "cause_identifier"
-        self.llm = ChatOpenAI(
-            model=model,
-            temperature=temperature,
-            max_tokens=800,
-            timeout=30
+    def __init__(self, llm: Optional[ChatOpenAI] = None):
+        self.agent_name = "combined_analyzer"
+        # JSON mode guarantees a parseable object, so no fence stripping
+        self.llm = (llm or get_shared_llm()).bind(
+            max_tokens=MAX_TOKENS_PER_EFFECT,
+            response_format={"type": "json_object"}
         )
     
-    def identify_causes(self, state: FishboneState) -> FishboneState:
-        """Identify causes for each Fishbone category."""
+    async def analyze(self, state: FishboneState) -> FishboneState:
+        """Identify causes per category and their 5 Whys root causes."""
         prompt = self._build_prompt(state["effect"], state["categories"])
+        data = await self._invoke_llm(self.llm, prompt)
         
-        try:
-            response = self.llm.invoke(prompt)
-            data = self._parse_response(response.content)
-            state["causes"] = self._extract_causes(data, state["categories"])
-        except Exception as e:
-            pass
-            state["causes"] = {cat: [] for cat in state["categories"]}
+        state["causes"] = self._extract_causes(data, state["categories"])
+        state["root_causes"] = self._organize_root_causes(
+            data.get("root_causes", {}),
+            state["causes"]
+        )
         
         return state
     
+    async def analyze_batch(
+        self,
+        effects: List[str],
+        categories: List[str]
+    ) -> List[Tuple[Dict[str, List[str]], Dict[str, Dict[str, List[str]]]]]:
+        """Analyze several effects in a single call, one result per effect."""
+        prompt = self._build_batch_prompt(effects, categories)
+        # A longer reply needs a proportionally longer request timeout
+        llm = self.llm.bind(
+            max_tokens=MAX_TOKENS_PER_EFFECT * len(effects),
+            timeout=REQUEST_TIMEOUT * len(effects)
+        )
+        items = (await self._invoke_llm(llm, prompt)).get("results")
+        if type(items) is not list:
+            items = []
+        
+        results = []
+        for item in self._match_batch_items(effects, items):
+            causes = self._extract_causes(item, categories)
+            root_causes = self._organize_root_causes(
+                item.get("root_causes", {}),
+                causes
+            )
+            results.append((causes, root_causes))
+        
+        return results
+    
+    def _match_batch_items(self, effects: List[str], items: List) -> List[Dict]:
+        """Pair each effect with the result item that echoes it back.
+        
+        Falls back to position only when the counts match and every item
+        that does name a known effect sits at that effect's position. An
+        effect left without an item gets an empty result.
+        """
+        items = [item if type(item) is dict else {} for item in items]
+        names = [
+            item["effect"].strip() if type(item.get("effect")) is str else None
+            for item in items
+        ]
+        by_effect = dict(zip(names, items))
+        
+        if all(effect in by_effect for effect in effects):
+            return [by_effect[effect] for effect in effects]
+        
+        aligned = len(items) == len(effects) and all(
+            name == effect or name not in effects
+            for name, effect in zip(names, effects)
+        )
+        if aligned:
+            return items
+        return [by_effect.get(effect, {}) for effect in effects]
+    
+    @retry(
+        retry=retry_if_exception(is_transient_error),
+        stop=stop_after_attempt(MAX_LLM_ATTEMPTS),
+        wait=wait_for_retry,
+        reraise=True
+    )
+    async def _invoke_llm(self, llm, prompt: List[Dict[str, str]]) -> Dict:
+        """Invoke the LLM and decode its JSON reply, retrying transient errors."""
+        response = await llm.ainvoke(prompt)
+        data = orjson.loads(response.content)
+        # A reply of the wrong shape is treated as an empty result
+        return data if type(data) is dict else {}
+    
     def _build_prompt(
         self,
         effect: str,
         categories: List[str]
     ) -> List[Dict[str, str]]:
-        """Build prompt for cause identification."""
+        """Build prompt for cause identification and root cause analysis."""
         return [
-            {
-                "role": "system",
-                "content": (
-                    f"You are a Root Cause Analysis expert. Return only JSON. "
-                    f"Maximum {MAX_CAUSES_PER_CATEGORY} causes per category. "
-                    f"Each cause should be 5 words or less."
-                )
-            },
+            {"role": "system", "content": _SYSTEM_PROMPT},
             {
                 "role": "user",
-                "content": (
-                    f'Effect: {effect}\n'
-                    f'Categories: {", ".join(categories)}\n\n'
-                    f'Return JSON format:\n'
-                    f'{{"effect": "{effect}", '
-                    f'"causes": {{"Category": ["cause1", "cause2", "cause3"]}}}}'
-                )
+                "content": f'Effect: {effect}\nCategories: {", ".join(categories)}'
             }
         ]
     
-    def _parse_response(self, text: str) -> Dict:
-        """Parse JSON response from LLM."""
-        try:
-            text = text.strip()
-            if '```json' in text:
-                text = text.split('```json')[1].split('```')[0].strip()
-            elif '```' in text:
-                text = text.split('```')[1].split('```')[0].strip()
-            return json.loads(text)
-        except (json.JSONDecodeError, IndexError):
-            return {"causes": {}}
-    
-    def _extract_causes(
+    def _build_batch_prompt(
         self,
-        data: Dict,
+        effects: List[str],
         categories: List[str]
-    ) -> Dict[str, List[str]]:
-        """Extract and validate causes from response."""
-        causes = data.get("causes", {})
-        result = {}
-        
-        for category in categories:
-            category_causes = causes.get(category, [])
-            if isinstance(category_causes, list):
-                result[category] = [
-                    c.strip() for c in category_causes 
-                    if c and c.strip()
-                ][:MAX_CAUSES_PER_CATEGORY]
-            else:
-                result[category] = []
-        
-        return result
-
-
-class RootCauseAnalyzerAgent:
-    """Agent for analyzing root causes using 5 Whys technique."""
-    
-    def __init__(self, model: str = MODEL, temperature: float = 0):
-        self.agent_name = "root_cause_analyzer"
-        self.llm = ChatOpenAI(
-            model=model,
-            temperature=temperature,
-            max_tokens=1000,
-            timeout=30
-        )
-    
-    def analyze_root_causes(self, state: FishboneState) -> FishboneState:
-        """Analyze root causes for identified causes."""
-        if not any(state["causes"].values()):
-            state["root_causes"] = {}
-            return state
-        
-        prompt = self._build_prompt(state["causes"])
-        
-        try:
-            response = self.llm.invoke(prompt)
-            data = self._parse_response(response.content)
-            state["root_causes"] = self._organize_root_causes(
-                data,
-                state["causes"]
-            )
-        except Exception as e:
-            pass
-            state["root_causes"] = {}
-        
-        return state
-    
-    def _build_prompt(
-        self,
-        causes: Dict[str, List[str]]
     ) -> List[Dict[str, str]]:
-        """Build prompt for root cause analysis."""
-        cause_items = []
-        for category, cause_list in causes.items():
-            for cause in cause_list:
-                cause_items.append(f'"{category}:{cause}"')
+        """Build a single prompt covering several effects."""
+        effect_lines = "\n".join(
+            f"{i}. {effect}" for i, effect in enumerate(effects, 1)
+        )
         
         return [
-            {
-                "role": "system",
-                "content": (
-                    f"Perform root cause analysis using 5 Whys. "
-                    f"Return only JSON. {MAX_ROOT_CAUSES_PER_CAUSE} reasons per cause. "
-                    f"Each reason should be 8 words or less."
-                )
-            },
+            {"role": "system", "content": _BATCH_SYSTEM_PROMPT},
             {
                 "role": "user",
                 "content": (
-                    f'Analyze why these causes occur:\n'
-                    f'[{", ".join(cause_items)}]\n\n'
-                    f'Return JSON format:\n'
-                    f'{{"Category:cause": ["why1", "why2", "why3"]}}'
+                    f'Categories: {", ".join(categories)}\n'
+                    f'Effects:\n{effect_lines}'
                 )
             }
         ]
     
-    def _parse_response(self, text: str) -> Dict:
-        """Parse JSON response from LLM."""
-        try:
-            text = text.strip()
-            if '```json' in text:
-                text = text.split('```json')[1].split('```')[0].strip()
-            elif '```' in text:
-                text = text.split('```')[1].split('```')[0].strip()
-            return json.loads(text)
-        except (json.JSONDecodeError, IndexError):
-            return {}
+    def _extract_causes(
+        self,
+        data: Dict,
+        categories: List[str]
+    ) -> Dict[str, List[str]]:
+        """Extract and validate causes from response."""
+        causes = data.get("causes")
+        if type(causes) is not dict:
+            causes = {}
+        causes_get = causes.get
+        limit = MAX_CAUSES_PER_CATEGORY
+        return {
+            category: clean_items(causes_get(category), limit)
+            for category in categories
+        }
     
     def _organize_root_causes(
         self,
@@ -207,33 +346,23 @@ class RootCauseAnalyzerAgent:
         causes: Dict[str, List[str]]
     ) -> Dict[str, Dict[str, List[str]]]:
         """Organize root causes by category and cause."""
-        result = {}
-        
-        for category, cause_list in causes.items():
-            result[category] = {}
-            for cause in cause_list:
-                key = f"{category}:{cause}"
-                if key in data and isinstance(data[key], list):
-                    result[category][cause] = [
-                        rc.strip() for rc in data[key][:MAX_ROOT_CAUSES_PER_CAUSE]
-                        if rc and rc.strip()
-                    ]
-                else:
-                    result[category][cause] = []
-        
-        return result
+        if type(data) is not dict:
+            data = {}
+        data_get = data.get
+        limit = MAX_ROOT_CAUSES_PER_CAUSE
+        return {
+            category: {
+                cause: clean_items(data_get(f"{category}:{cause}"), limit)
+                for cause in cause_list
+            }
+            for category, cause_list in causes.items()
+        }
 
 class ResultFormatterAgent:
     """Agent for formatting and finalizing results."""
     
-    def __init__(self, model: str = MODEL, temperature: float = 0):
+    def __init__(self):
         self.agent_name = "result_formatter"
-        self.llm = ChatOpenAI(
-            model=model,
-            temperature=temperature,
-            max_tokens=1000,
-            timeout=30
-        )
     
     def format_results(self, state: FishboneState) -> FishboneState:
         """Add metadata and finalize results."""
@@ -251,99 +380,312 @@ class FishboneAnalyzer:
     """Orchestrator for the multi-agent Fishbone analysis."""
     
     def __init__(self):
-        self.cause_identifier = CauseIdentifierAgent()
-        self.root_analyzer = RootCauseAnalyzerAgent()
-        self.result_formatter = ResultFormatterAgent()
-        self.workflow = self._build_workflow()
+        (
+            self.combined_analyzer,
+            self.result_formatter,
+            self.workflow
+        ) = self._shared_workflow()
+        
+        # Optionally open the API connection before the first analysis
+        self._prewarm_task = None
+        if os.getenv("PREWARM") == "1":
+            self._prewarm_task = self._start_prewarm()
+    
+    def _start_prewarm(self) -> Optional[asyncio.Task]:
+        """Schedule the warm-up request on the running event loop, if any."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+        return loop.create_task(self._prewarm())
+    
+    async def _prewarm(self) -> None:
+        """Establish a pooled connection to the API with a free request."""
+        try:
+            await get_shared_llm().root_async_client.models.list()
+        except OpenAIError:
+            # Best effort: the first analysis reports any real problem
+            pass
+    
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _shared_workflow(
+        cls
+    ) -> Tuple[CombinedAnalyzerAgent, ResultFormatterAgent, CompiledStateGraph]:
+        """Build the agents and compile their workflow once per process."""
+        combined_analyzer = CombinedAnalyzerAgent()
+        result_formatter = ResultFormatterAgent()
+        workflow = cls._build_workflow(combined_analyzer, result_formatter)
+        return combined_analyzer, result_formatter, workflow
     
-    def _build_workflow(self) -> StateGraph:
+    @staticmethod
+    def _build_workflow(
+        combined_analyzer: CombinedAnalyzerAgent,
+        result_formatter: ResultFormatterAgent
+    ) -> CompiledStateGraph:
         """Build the agent workflow graph."""
         graph = StateGraph(FishboneState)
         
         # Register agent functions as nodes
-        graph.add_node("identify_causes", self.cause_identifier.identify_causes)
-        graph.add_node("analyze_roots", self.root_analyzer.analyze_root_causes)
-        graph.add_node("format_results", self.result_formatter.format_results)
+        graph.add_node(
+            "analyze_causes",
+            combined_analyzer.analyze,
+            cache_policy=CachePolicy(key_func=analysis_cache_key)
+        )
+        graph.add_node("format_results", result_formatter.format_results)
         
         # Define workflow sequence
-        graph.set_entry_point("identify_causes")
-        graph.add_edge("identify_causes", "analyze_roots")
-        graph.add_edge("analyze_roots", "format_results")
+        graph.set_entry_point("analyze_causes")
+        graph.add_edge("analyze_causes", "format_results")
         graph.add_edge("format_results", END)
         
-        return graph.compile()
+        # Deterministic (temperature=0) nodes are served from cache on re-runs
+        return graph.compile(cache=GraphCache())
     
-    def analyze(
+    async def analyze(
         self,
         effect: str,
         categories: Optional[List[str]] = None
     ) -> Dict:
         """Execute the Fishbone analysis workflow."""
+        initial_state = self._initial_state(effect, categories)
+        
+        # Run workflow
+        try:
+            result = await self.workflow.ainvoke(initial_state)
+        except Exception as e:
+            print(f"\n❌ Analysis failed: {e}")
+            result = self._failed_result(initial_state)
+        
+        return self._extract_results(result)
+    
+    async def analyze_batch(
+        self,
+        effects: List[str],
+        categories: Optional[List[str]] = None
+    ) -> List[Dict]:
+        """Execute the Fishbone analysis for several effects."""
+        states = [self._initial_state(effect, categories) for effect in effects]
+        if not states:
+            return []
+        
+        if len(states) > MAX_BATCH_SIZE:
+            # Large batches degrade in one prompt; analyze effects in parallel
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+            
+            async def analyze_one(state: FishboneState) -> Dict:
+                async with semaphore:
+                    return await self.analyze(state["effect"], state["categories"])
+            
+            return list(await asyncio.gather(*map(analyze_one, states)))
+        
+        try:
+            analyses = await self.combined_analyzer.analyze_batch(
+                [state["effect"] for state in states],
+                states[0]["categories"]
+            )
+        except Exception as e:
+            print(f"\n❌ Batch analysis failed: {e}")
+            return [
+                self._extract_results(self._failed_result(state))
+                for state in states
+            ]
+        
+        results = []
+        for state, (causes, root_causes) in zip(states, analyses):
+            state["causes"] = causes
+            state["root_causes"] = root_causes
+            state = self.result_formatter.format_results(state)
+            results.append(self._extract_results(state))
+        
+        return results
+    
+    async def analyze_stream(
+        self,
+        effect: str,
+        categories: Optional[List[str]] = None
+    ) -> Dict:
+        """Execute the workflow, displaying output as it is generated."""
+        initial_state = self._initial_state(effect, categories)
+        result = dict(initial_state)
+        self._display_header(initial_state["effect"])
+        
+        tokens = 0
+        try:
+            async for mode, chunk in self.workflow.astream(
+                initial_state,
+                stream_mode=["messages", "updates"]
+            ):
+                if mode == "messages":
+                    # Show progress rather than the raw JSON reply; sections,
+                    # errors and the footer each start on a new line
+                    tokens += 1
+                    if tokens % TOKENS_PER_PROGRESS_DOT == 0:
+                        print(".", end="", flush=True)
+                    continue
+                
+                for update in chunk.values():
+                    # Nodes return the full state, so only show what changed
+                    changed = {k: v for k, v in update.items() if result.get(k) != v}
+                    result.update(changed)
+                    self.display_partial(changed)
+        except Exception as e:
+            print(f"\n❌ Analysis failed: {e}")
+            result = self._failed_result(initial_state)
+        
+        results = self._extract_results(result)
+        self._display_footer(results)
+        return results
+    
+    def _initial_state(
+        self,
+        effect: str,
+        categories: Optional[List[str]]
+    ) -> FishboneState:
+        """Validate input and build the initial workflow state."""
         if not effect.strip():
             raise ValueError("Effect cannot be empty")
         
-        # Initialize state
-        initial_state = FishboneState(
+        return FishboneState(
             effect=effect.strip(),
             categories=categories or CATEGORIES_6M.copy(),
             causes={},
             root_causes={},
             metadata={}
         )
+    
+    def _failed_result(self, state: FishboneState) -> FishboneState:
+        """Finalize a failed analysis with empty causes.
         
-        # Run workflow
-        result = self.workflow.invoke(initial_state)
-        
-        # Extract relevant data for output
+        Handled here rather than inside the cached analysis node, so a
+        failed run is never served from the node cache; JSONResponseCache
+        likewise never stores an undecodable LLM reply.
+        """
+        state["causes"] = {cat: [] for cat in state["categories"]}
+        state["root_causes"] = {}
+        return self.result_formatter.format_results(state)
+    
+    def _extract_results(self, state: Dict) -> Dict:
+        """Extract relevant data for output."""
         return {
-            "effect": result["effect"],
-            "causes": result["causes"],
-            "root_causes": result["root_causes"],
-            "metadata": result["metadata"]
+            "effect": state["effect"],
+            "causes": state["causes"],
+            "root_causes": state["root_causes"],
+            "metadata": state["metadata"]
         }
     
     def display_results(self, results: Dict) -> None:
         """Display analysis results in formatted output."""
-        print("\n" + "="*80)
-        print(f"FISHBONE ANALYSIS: {results['effect']}")
-        print("="*80)
-        
-        has_results = False
-        for category, causes in results["causes"].items():
+        self._display_header(results["effect"])
+        self.display_partial(results)
+        self._display_footer(results)
+    
+    def display_partial(self, update: Dict) -> None:
+        """Display the category sections contained in a state update."""
+        root_causes = update.get("root_causes", {})
+        for category, causes in update.get("causes", {}).items():
             if causes:
-                has_results = True
                 print(f"\n📁 {category}:")
                 for cause in causes:
                     print(f"   ├── {cause}")
                     
                     # Show root causes
-                    root_causes = results["root_causes"].get(category, {}).get(cause, [])
-                    for i, rc in enumerate(root_causes):
+                    cause_roots = root_causes.get(category, {}).get(cause, [])
+                    for i, rc in enumerate(cause_roots):
                         if rc and rc != "Analysis pending":
-                            connector = "└──" if i == len(root_causes) - 1 else "├──"
+                            connector = "└──" if i == len(cause_roots) - 1 else "├──"
                             print(f"   │   {connector} Why? {rc}")
-        
-        if not has_results:
+    
+    def _display_header(self, effect: str) -> None:
+        """Display the analysis banner."""
+        print("\n" + "="*80)
+        print(f"FISHBONE ANALYSIS: {effect}")
+        print("="*80)
+    
+    def _display_footer(self, results: Dict) -> None:
+        """Display the completion summary."""
+        if not any(results["causes"].values()):
             print("\n❌ No causes identified. Please check your API key and try again.")
         
         print(f"\n⏰ Completed at: {results['metadata'].get('timestamp')}")
         print("-"*80)
     
-    def save_results(self, results: Dict, filename: Optional[str] = None) -> None:
-        """Save results to JSON file."""
-        if not filename:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"fishbone_analysis_{timestamp}.json"
+    def default_filename(self, results: Dict, index: Optional[int] = None) -> str:
+        """Build a results filename from the analysis timestamp."""
+        # Reuse the analysis timestamp so filename and metadata agree
+        analyzed_at = datetime.fromisoformat(results["metadata"]["timestamp"])
+        timestamp = analyzed_at.strftime("%Y%m%d_%H%M%S")
+        if index is not None:
+            timestamp += f"_{index}"
+        return f"fishbone_analysis_{timestamp}.json"
+    
+    async def save_results(self, results: Dict, filename: Optional[str] = None) -> str:
+        """Save results to JSON file without blocking the event loop.
+        
+        Returns a status line for the caller to print, so a save running in
+        the background never writes into the middle of other output.
+        """
+        filename = filename or self.default_filename(results)
         
         try:
-            with open(filename, "w", encoding="utf-8") as f:
-                json.dump(results, f, indent=2, ensure_ascii=False)
-            print(f"✅ Results saved to: {filename}")
+            async with aiofiles.open(filename, "wb") as f:
+                await f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+            return f"✅ Results saved to: {filename}"
         except IOError as e:
-            print(f"❌ Error saving file: {e}")
+            return f"❌ Error saving file: {e}"
+
+async def ainput(prompt: str) -> str:
+    """Read a line from stdin without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    
+    def resolve(setter, value):
+        if not future.done():
+            setter(value)
+    
+    def read_line():
+        try:
+            result = input(prompt)
+        except Exception as e:
+            loop.call_soon_threadsafe(resolve, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(resolve, future.set_result, result)
+    
+    # Daemon thread so Ctrl+C does not wait for a pending input() on exit
+    threading.Thread(target=read_line, daemon=True).start()
+    return await future
+
+async def run_batch(analyzer: FishboneAnalyzer, path: str) -> None:
+    """Analyze each non-blank line of a text file as a separate problem."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            effects = [line.strip() for line in f if line.strip()]
+    except IOError as e:
+        print(f"Error reading file: {e}")
+        sys.exit(1)
+    
+    print(f"\n🔄 Analyzing {len(effects)} problems from: {path}")
+    print("⏳ Please wait...")
+    
+    results = await analyzer.analyze_batch(effects)
+    for index, result in enumerate(results, 1):
+        analyzer.display_results(result)
+        print(await analyzer.save_results(result, analyzer.default_filename(result, index)))
+    
+    print(f"\n✅ Batch completed. Analyses performed: {len(results)}")
 
 def main():
     """Main entry point for interactive Fishbone analysis."""
+    try:
+        asyncio.run(main_async())
+    except KeyboardInterrupt:
+        # Exit without interpreter cleanup, which would block on the
+        # stdin lock held by a pending ainput() read
+        sys.stdout.flush()
+        os._exit(130)
+
+async def main_async():
+    """Interactive Fishbone analysis loop, or batch mode given a file."""
     # Check for API key
     if not os.getenv("OPENAI_API_KEY"):
         print("Error: Please set OPENAI_API_KEY in your .env file")
@@ -360,42 +702,70 @@ def main():
         print(f"Error initializing system: {e}")
         sys.exit(1)
     
+    # Batch mode: python fishbone.py problems.txt
+    if len(sys.argv) > 1:
+        await run_batch(analyzer, sys.argv[1])
+        return
+    
     analysis_count = 0
+    pending_saves = set()
+    interrupted = False
     
     # Interactive loop
-    while True:
-        effect = input("\nEnter problem to analyze (or 'quit' to exit): ").strip()
-        
-        if effect.lower() in ['quit', 'exit', 'q']:
-            break
-        
-        if not effect:
-            print("Please enter a valid problem statement.")
-            continue
-        
-        try:
-            print(f"\n🔄 Analyzing: {effect}")
-            print("⏳ Please wait...")
+    try:
+        while True:
+            # Report background saves before showing the prompt; a save slower
+            # than the grace period is reported before a later prompt instead
+            if pending_saves:
+                done, _ = await asyncio.wait(pending_saves, timeout=SAVE_REPORT_GRACE)
+                for save_task in done:
+                    pending_saves.discard(save_task)
+                    print(save_task.result())
             
-            # Run analysis
-            results = analyzer.analyze(effect)
+            effect = (await ainput("\nEnter problem to analyze (or 'quit' to exit): ")).strip()
             
-            # Display and save results
-            analyzer.display_results(results)
-            analyzer.save_results(results)
+            if effect.lower() in ['quit', 'exit', 'q']:
+                break
             
-            analysis_count += 1
+            if not effect:
+                print("Please enter a valid problem statement.")
+                continue
             
-        except KeyboardInterrupt:
-            print("\n\nAnalysis interrupted.")
-            break
-        except Exception as e:
-            print(f"Error during analysis: {e}")
-            continue
+            try:
+                print(f"\n🔄 Analyzing: {effect}")
+                print("⏳ Please wait...")
+                
+                # Run analysis, displaying results as they stream in
+                results = await analyzer.analyze_stream(effect)
+                
+                # Save results in the background while the next prompt is shown
+                save_task = asyncio.create_task(analyzer.save_results(results))
+                pending_saves.add(save_task)
+                
+                analysis_count += 1
+                
+            except Exception as e:
+                print(f"Error during analysis: {e}")
+                continue
+    
+    except EOFError:
+        # End of input (Ctrl+D or a closed pipe) ends the session
+        pass
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        # Ctrl+C at the prompt or during an analysis
+        print("\n\nAnalysis interrupted.")
+        interrupted = True
+    
+    # Shielded so an interrupt never cancels a save of a completed analysis
+    for message in await asyncio.shield(asyncio.gather(*pending_saves)):
+        print(message)
     
     print(f"\n✅ Session completed. Analyses performed: {analysis_count}")
     print("Thank you for using the Fishbone Analysis System!")
+    
+    if interrupted:
+        # Saves are done; let main() exit past the pending stdin read
+        raise KeyboardInterrupt
 
 if __name__ == "__main__":
     main()
-